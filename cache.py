@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+cache.py
+
+A cache for results of upstream queries (Twitch, last.fm, Minecraft).
+Stale results are served immediately while fresh ones are fetched in the
+background. The cache can be saved to and loaded from a snapshot file (one
+JSON line per entry) so results survive restarts with their original
+timestamps. An optional backend (see coordination.py) may share results
+between instances.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import collections
+import functools
+import json
+import logging
+import os
+import time
+
+Entry = collections.namedtuple("Entry", ["stamp", "value"])
+
+
+class Cache:
+    """
+    The cache maps keys to timestamped results of upstream queries.
+    It holds up to capacity entries and evicts the least recently used ones.
+    """
+    logger = logging.getLogger("cache")
+
+    def __init__(self, *, capacity=1024, max_age=86400):
+        """Initialize an empty cache."""
+        self.capacity = capacity
+        self.max_age = max_age
+        self.entries = collections.OrderedDict()
+        self.pending = dict()
+        self.dirty = False
+        self.backend = None
+
+    @staticmethod
+    def make_key(name, args):
+        """Create a key for a named query and its positional arguments."""
+        return json.dumps([name, args], separators=(",", ":"))
+
+    def get(self, key):
+        """Get the entry for a key or None if there is no such entry."""
+        entry = self.entries.get(key)
+        if entry:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, stamp=None):
+        """Store a value with a timestamp (defaults to now) for a key."""
+        self.entries[key] = Entry(stamp or time.time(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def discard(self, key):
+        """Remove the entry for a key if there is one."""
+        if self.entries.pop(key, None):
+            self.dirty = True
+
+    def fetch(self, key, ttl, timeout, func, *args, **kwargs):
+        """
+        Fetch a value younger than ttl seconds for a key and store it. A
+        result of None discards the key's entry instead. Concurrent fetches
+        for the same key share a single upstream query, which is abandoned
+        after timeout seconds (unless timeout is None).
+        Returns the task performing the query.
+        """
+        task = self.pending.get(key)
+        if task:
+            return task
+
+        async def query():
+            return await asyncio.wait_for(func(*args, **kwargs), timeout)
+
+        async def update():
+            if self.backend:
+                (stamp, value) = await self.backend.fetch(key, ttl, query)
+            else:
+                (stamp, value) = (None, await query())
+            if value is None:
+                self.discard(key)
+            else:
+                self.put(key, value, stamp)
+            return value
+
+        task = asyncio.ensure_future(update())
+        self.pending[key] = task
+        task.add_done_callback(lambda _: self.pending.pop(key, None))
+        return task
+
+    def refresh(self, key, ttl, timeout, func, *args, **kwargs):
+        """Fetch a fresh value for a key in the background."""
+        def done(task):
+            if not task.cancelled() and task.exception():
+                self.logger.error("Refreshing {key} failed: {exc!r}".format(
+                    key=key, exc=task.exception()))
+
+        task = self.fetch(key, ttl, timeout, func, *args, **kwargs)
+        task.add_done_callback(done)
+
+    def cached(self, name, *, ttl, max_age=None, timeout=None):
+        """
+        A decorator caching the results of an upstream query coroutine.
+        Results younger than ttl seconds are returned as they are, older ones
+        are returned as well but trigger a refresh in the background. Results
+        older than max_age seconds (defaults to the cache's) are never
+        returned. Queries taking longer than timeout seconds are abandoned.
+        Keyword arguments (like the event loop) are not part of the key.
+        """
+        max_age = max_age or self.max_age
+
+        def decorator(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = self.make_key(name, args)
+                entry = self.get(key)
+                age = time.time() - entry.stamp if entry else None
+
+                if entry and age < ttl:
+                    return entry.value
+
+                if entry and age < max_age:
+                    self.logger.debug("Serving stale {0}.".format(key))
+                    self.refresh(key, ttl, timeout, func, *args, **kwargs)
+                    return entry.value
+
+                # don't abort a shared query if our caller times out
+                task = self.fetch(key, ttl, timeout, func, *args, **kwargs)
+                return await asyncio.shield(task)
+
+            return wrapper
+
+        return decorator
+
+    def load(self, path):
+        """Load entries from a snapshot file, skipping expired ones."""
+        try:
+            snapshot = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            self.logger.info("No cache snapshot at {0}.".format(path))
+            return
+
+        oldest = time.time() - self.max_age
+        with snapshot:
+            for line in snapshot:
+                try:
+                    (key, stamp, value) = json.loads(line)
+                    if float(stamp) > oldest:
+                        self.entries[key] = Entry(float(stamp), value)
+                except (ValueError, TypeError):
+                    self.logger.warning("Skipping malformed cache entry.")
+
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+        self.logger.info("Loaded {nof} cache entries from {path}.".format(
+            nof=len(self.entries), path=path))
+
+    def save(self, path):
+        """Save all entries to a snapshot file if anything has changed."""
+        if not self.dirty:
+            return
+
+        # write a temporary file first so a crash never leaves half a snapshot
+        temp_path = "{0}.tmp".format(path)
+        with open(temp_path, "w", encoding="utf-8") as snapshot:
+            for (key, entry) in self.entries.items():
+                line = json.dumps([key, entry.stamp, entry.value],
+                                  separators=(",", ":"))
+                snapshot.write(line + "\n")
+        os.replace(temp_path, path)
+        self.dirty = False
+
+        self.logger.debug("Saved {nof} cache entries to {path}.".format(
+            nof=len(self.entries), path=path))
+
+    async def persist(self, path, interval=60.0):
+        """Periodically save the cache to a snapshot file."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save(path)
+            except (OSError, TypeError, ValueError) as e:
+                self.logger.error("Cannot save cache snapshot: {0}".format(e))
+
+
+# the cache shared by all upstream queries
+store = Cache()
+cached = store.cached
@@ -12,11 +12,16 @@ See the file LICENSE for copying permission.
 
 import aiomc
 import asyncio
+import cache
+import collections
+import dice
 import functools
+import importlib
 import locale
 import logging
 import re
 import songs
+import sys
 import twitch
 
 BINGO_URL = "https://pump19.eu/bingo"
@@ -37,6 +42,8 @@ LRRMC_SERVERS = {
     }
 }
 
+ROLL_SHOW_DICE = 10
+
 CMD_REGEX = {
     "vod":
         re.compile("^vod$"),
@@ -47,13 +54,25 @@ CMD_REGEX = {
     "lastfm":
         re.compile("^(?:last\.fm|🎵) (?P<user>\w+)$", re.ASCII),
     "roll":
-        re.compile("^(?:roll|🎲)(?: (?P<count>\d+)?d(?P<sides>\d+))?"),
+        re.compile("^(?:roll|🎲)(?: (?P<count>\d+)?d(?P<sides>\d+)"
+                   "(?:(?P<selector>[kd][hl]?)(?P<amount>\d+))?"
+                   "(?P<modifier>[+-]\d+)?)?$"),
     "bingo":
         re.compile("^bingo$"),
     "help":
         re.compile("^help|🚑$")
 }
 
+# upstream queries are cached, stale results are refreshed in the background
+get_broadcasts = cache.cached(
+        "broadcasts", ttl=300, timeout=30.0)(twitch.get_broadcasts)
+get_top_clips = cache.cached(
+        "clips", ttl=300, timeout=30.0)(twitch.get_top_clips)
+get_mc_status = cache.cached(
+        "lrrmc", ttl=60, max_age=600, timeout=2.0)(aiomc.get_status)
+get_lastfm_info = cache.cached(
+        "lastfm", ttl=60, max_age=600, timeout=10.0)(songs.get_lastfm_info)
+
 # set up locale for currency formatting (patreon command wants that)
 locale.setlocale(locale.LC_MONETARY, "en_US.utf8")
 
@@ -68,30 +87,54 @@ class CommandHandler:
     class Limiter:
         """
         A decorator that suppresses method calls within a certain time span.
+        Calls are limited per target (the first argument after self).
         """
 
         logger = logging.getLogger("command.limiter")
 
-        def __init__(self, *, span=15, loop=None):
-            """Initialize rate limiter with a default delay of 15."""
+        def __init__(self, *, span=15, loop=None, backend=None,
+                     network=None):
+            """
+            Initialize rate limiter with a default delay of 15.
+            A backend (see coordination.py) may share windows between
+            instances, shared windows are kept per network and target.
+            """
             self.span = span
             self.loop = loop or asyncio.get_event_loop()
+            self.backend = backend
+            self.network = network
 
         def __call__(self, func):
 
             @functools.wraps(func)
             async def wrapper(*args, **kwargs):
+                target = args[1]
                 now = self.loop.time()
-                if (now - wrapper._spam_last) > wrapper._spam_span:
-                    wrapper._spam_last = now
+                if (now - wrapper._spam_last.get(target, 0.0) >
+                        wrapper._spam_span):
+                    # forget targets whose windows have passed
+                    for (passed, last) in list(wrapper._spam_last.items()):
+                        if now - last > wrapper._spam_span:
+                            del wrapper._spam_last[passed]
+                    wrapper._spam_last[target] = now
+                    name = "{network}/{target}/{func}".format(
+                            network=self.network, target=target,
+                            func=func.__name__)
+                    if self.backend and not await self.backend.claim(
+                            name, wrapper._spam_span):
+                        self.logger.warning(
+                                "Call to {name} claimed elsewhere.".format(
+                                    name=name))
+                        return
                     await func(*args, **kwargs)
                 else:
-                    self.logger.warning("Suppressed call to {name}.".format(
-                        name=func.__name__))
+                    self.logger.warning(
+                            "Suppressed call to {name} in {target}.".format(
+                                name=func.__name__, target=target))
 
-            # each wrapper remembers its own delay and last call
+            # each wrapper remembers its own delay and last call per target
             wrapper._spam_span = self.span
-            wrapper._spam_last = 0.0
+            wrapper._spam_last = dict()
 
             return wrapper
 
@@ -101,7 +144,8 @@ class CommandHandler:
         """A simple router matching strings against a set of regular
            expressions match to a callable."""
 
-        routes = list()
+        def __init__(self):
+            self.routes = list()
 
         def add_route(self, regex, callback):
             self.routes.append((regex, callback))
@@ -117,28 +161,215 @@ class CommandHandler:
 
             return None
 
-    router = CommandRouter()
+    class CommandExecutor:
+        """
+        An executor bounding the number of concurrently running calls per
+        command. Calls exceeding that limit wait in a bounded queue. Calls
+        that find the queue full or don't finish before their deadline are
+        shed.
+        """
+
+        logger = logging.getLogger("command.executor")
 
-    def __init__(self, client, *, loop=None, prefix="&", override=None):
+        def __init__(self, *, limit=2, queue=4, deadline=15.0, loop=None):
+            """Initialize the executor with empty queues and counters."""
+            self.limit = limit
+            self.queue = queue
+            self.deadline = deadline
+            self.loop = loop or asyncio.get_event_loop()
+
+            self.running = collections.Counter()
+            self.waiters = collections.defaultdict(collections.deque)
+            self.counters = collections.Counter()
+
+        async def acquire(self, name, timeout):
+            """Wait for a slot to run a command, return whether we got one."""
+            if self.running[name] < self.limit:
+                self.running[name] += 1
+                return True
+
+            waiters = self.waiters[name]
+            if len(waiters) >= self.queue:
+                return False
+
+            waiter = self.loop.create_future()
+            waiters.append(waiter)
+            try:
+                # a releasing call hands its slot over by resolving the waiter,
+                # unlike wait_for this never swallows our cancellation
+                await asyncio.wait((waiter,), timeout=timeout)
+            except asyncio.CancelledError:
+                if waiter.done():
+                    self.release(name)
+                else:
+                    waiter.cancel()
+                    waiters.remove(waiter)
+                raise
+
+            if waiter.done():
+                return True
+
+            waiter.cancel()
+            waiters.remove(waiter)
+            return False
+
+        def release(self, name):
+            """Hand a slot over to the next waiting call or free it."""
+            waiters = self.waiters[name]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+
+            self.running[name] -= 1
+
+        async def run(self, name, func, *args):
+            """
+            Run a command unless it has to be shed.
+            Returns False if the call has been shed before it started.
+            """
+            start = self.loop.time()
+            acquired = await self.acquire(name, self.deadline)
+            remaining = self.deadline - (self.loop.time() - start)
+
+            # a slot handed over right at the deadline is no use either
+            if acquired and remaining <= 0:
+                self.release(name)
+                acquired = False
+
+            if not acquired:
+                self.logger.warning("Shed call to {0}.".format(name))
+                self.counters[name, "shed"] += 1
+                return False
+
+            try:
+                await asyncio.wait_for(func(*args), remaining)
+            except asyncio.TimeoutError:
+                self.logger.warning("Call to {0} expired.".format(name))
+                self.counters[name, "expired"] += 1
+            except Exception:
+                self.logger.exception("Call to {0} failed.".format(name))
+                self.counters[name, "failed"] += 1
+            else:
+                self.counters[name, "completed"] += 1
+            finally:
+                self.release(name)
+
+            return True
+
+        def log_counters(self):
+            """Log how many calls completed, failed, expired or were shed."""
+            for ((name, outcome), count) in sorted(self.counters.items()):
+                self.logger.info("{name}: {count} {outcome}.".format(
+                    name=name, count=count, outcome=outcome))
+
+    def __init__(self, client, *, loop=None, backend=None,
+                 prefix="&", override=None,
+                 broadcaster="loadingreadyrun", broadcasters=None,
+                 limit=2, queue=4, deadline=15.0, busy=None):
         """Initialize the command handler and register for PRIVMSG events."""
         self.logger.info("Creating CommandHandler instance.")
 
         self.prefix = tuple(prefix)
         self.override = override
+        self.broadcaster = broadcaster
+        self.broadcasters = broadcasters or dict()
+        self.busy = busy
         self.client = client
-        self.client.event_handler("PRIVMSG")(self.handle_privmsg)
+        self.client.event_handler("PRIVMSG")(self.dispatch_privmsg)
         self.loop = loop or asyncio.get_event_loop()
         self.rate_limited.loop = loop
+        self.rate_limited.backend = backend
+        self.rate_limited.network = client.hostname
+        self.backend = backend
+        self.twitch = twitch.Client(loop=self.loop)
+        self.executor = self.CommandExecutor(
+                limit=limit, queue=queue, deadline=deadline, loop=self.loop)
 
         self.setup_routing()
+        self.loop.create_task(self.resolve_broadcasters())
 
     def setup_routing(self):
         """Connect command handlers to regular expressions using the router."""
+        router = self.CommandRouter()
         for key, regex in CMD_REGEX.items():
             cmd_name = "handle_command_{0}".format(key)
             handle_command = getattr(self, cmd_name, None)
             if handle_command and callable(handle_command):
-                self.router.add_route(regex, handle_command)
+                router.add_route(regex, handle_command)
+
+        # replace the router at once, commands may arrive any time
+        self.router = router
+
+    def reload(self, *, prefix="&", override=None,
+               broadcaster="loadingreadyrun", broadcasters=None,
+               limit=2, queue=4, deadline=15.0, busy=None):
+        """
+        Reload this module and rebuild the router in place.
+        Command handlers, regular expressions and the PRIVMSG dispatch are
+        taken from the reloaded module, rate limiter windows are kept.
+        """
+        self.logger.info("Reloading CommandHandler.")
+
+        # remember rate limiter windows, the reloaded module has new wrappers
+        # (older versions kept a single window per method, drop those)
+        windows = {name: method._spam_last
+                   for (name, method) in vars(type(self)).items()
+                   if isinstance(getattr(method, "_spam_last", None), dict)}
+
+        module = importlib.reload(sys.modules[__name__])
+        self.__class__ = module.CommandHandler
+
+        for (name, last) in windows.items():
+            method = vars(type(self)).get(name)
+            if hasattr(method, "_spam_last"):
+                method._spam_last = last
+
+        self.prefix = tuple(prefix)
+        self.override = override
+        self.broadcaster = broadcaster
+        self.broadcasters = broadcasters or dict()
+        self.busy = busy
+        self.rate_limited.loop = self.loop
+        self.rate_limited.backend = self.backend
+        self.rate_limited.network = self.client.hostname
+
+        # keep the executor, calls in flight hold slots in its queues
+        self.executor.limit = limit
+        self.executor.queue = queue
+        self.executor.deadline = deadline
+
+        self.setup_routing()
+        self.loop.create_task(self.resolve_broadcasters())
+
+    async def resolve_broadcasters(self):
+        """Resolve the channel IDs of all configured broadcasters at once."""
+        logins = set(self.broadcasters.values())
+        logins.add(self.broadcaster)
+
+        try:
+            ids = await self.twitch.get_ids(logins)
+        except Exception as e:
+            self.logger.error("Cannot resolve broadcasters: {0!r}".format(e))
+            return
+
+        missing = sorted(login for (login, cid) in ids.items() if not cid)
+        if missing:
+            self.logger.warning("No such Twitch channel(s): {0}.".format(
+                ",".join(missing)))
+
+    def get_broadcaster(self, target):
+        """Get the Twitch login of the broadcaster associated with target."""
+        return self.broadcasters.get(target.lower(), self.broadcaster)
+
+    async def dispatch_privmsg(self, **kwargs):
+        """
+        Pass a PRIVMSG event on to handle_privmsg.
+        This is what gets registered with the client, looking up
+        handle_privmsg on every call makes reloading replace it.
+        """
+        await type(self).handle_privmsg(self, **kwargs)
 
     async def handle_privmsg(self, nick, target, message, **kwargs):
         """
@@ -159,8 +390,16 @@ class CommandHandler:
 
         # check if we can handle that command
         handle_command = self.router.get_route(cmd)
-        if handle_command and callable(handle_command):
-            await handle_command(target, nick)
+        if not handle_command or not callable(handle_command):
+            return
+
+        name = handle_command.func.__name__
+        if await self.executor.run(name, handle_command, target, nick):
+            return
+
+        # don't queue up busy replies behind other messages
+        if self.busy and not self.client.msglock.locked():
+            await self.client.privmsg(target, self.busy)
 
     @rate_limited
     async def handle_command_vod(self, target, nick):
@@ -168,8 +407,15 @@ class CommandHandler:
         Handle !vod command.
         Post the most recent Twitch.tv broadcast.
         """
-        broadcasts = await twitch.get_broadcasts(27132299, 1)
-        vod = next(broadcasts, None)
+        broadcaster = self.get_broadcaster(target)
+        channel_id = await self.twitch.get_id(broadcaster)
+        if not channel_id:
+            no_vod_msg = "Cannot find Twitch channel {0}.".format(broadcaster)
+            await self.client.privmsg(target, no_vod_msg)
+            return
+
+        broadcasts = await get_broadcasts(channel_id, 1)
+        vod = next(iter(broadcasts), None)
 
         broadcast_msg = "Latest Broadcast: {0} [{2}] | {1}".format(*vod)
 
@@ -181,8 +427,8 @@ class CommandHandler:
         Handle !clip command.
         Post the most viewed Twitch.tv clip.
         """
-        clips = await twitch.get_top_clips("loadingreadyrun", 1)
-        clip = next(clips, None)
+        clips = await get_top_clips(self.get_broadcaster(target), 1)
+        clip = next(iter(clips), None)
 
         clip_msg = "Top Clip: {0} [{2}] | https://clips.twitch.tv/{1}".format(
                 *clip)
@@ -196,7 +442,7 @@ class CommandHandler:
         """
         server = LRRMC_SERVERS.get(server, LRRMC_SERVERS["vanilla"])
         # don't stall forever when querying status
-        status_coro = aiomc.get_status(
+        status_coro = get_mc_status(
             server["host"], server["port"],
             loop=self.loop)
 
@@ -231,7 +477,7 @@ class CommandHandler:
         Query information on the provided last.fm user handle and print the
         most recently listened track.
         """
-        coro = songs.get_lastfm_info(user, loop=self.loop)
+        coro = get_lastfm_info(user, loop=self.loop)
 
         info = await coro
         if not info:
@@ -259,10 +505,47 @@ class CommandHandler:
 
     @rate_limited
     async def handle_command_roll(self, target, nick, *,
-                                  count=None, sides=None):
-        await self.client.privmsg(
-                target,
-                "THIS is why we can't have nice things!")
+                                  count=None, sides=None,
+                                  selector=None, amount=None, modifier=None):
+        """
+        Handle !roll command.
+        Roll some dice (1d6 by default) and post the result. Optionally keep
+        or drop the highest or lowest dice and add a modifier.
+        """
+        count = int(count or 1)
+        sides = int(sides or 6)
+        modifier = int(modifier or 0)
+
+        try:
+            (keep, lowest) = dice.selection(count, selector, int(amount or 0))
+            result = dice.roll(count, sides, keep=keep, lowest=lowest,
+                               modifier=modifier)
+        except ValueError as e:
+            await self.client.privmsg(
+                    target, "THIS is why we can't have nice things! "
+                            "{0}".format(e))
+            return
+
+        notation = "{count}d{sides}{selector}{amount}{modifier}".format(
+                count=count, sides=sides,
+                selector=selector or "", amount=amount or "",
+                modifier="{0:+d}".format(modifier) if modifier else "")
+
+        # only list individual dice for small rolls, dropped ones in brackets
+        if result.dice and len(result.dice) <= ROLL_SHOW_DICE:
+            terms = ["({0})".format(die) if index in result.dropped
+                     else str(die)
+                     for (index, die) in enumerate(result.dice)]
+            if modifier:
+                terms.append("{0:+d}".format(modifier))
+            roll_msg = "{nick} rolled {notation}: {dice} = {total}".format(
+                    nick=nick, notation=notation, dice=" ".join(terms),
+                    total=result.total)
+        else:
+            roll_msg = "{nick} rolled {notation}: {total}".format(
+                    nick=nick, notation=notation, total=result.total)
+
+        await self.client.privmsg(target, roll_msg)
 
     @rate_limited
     async def handle_command_bingo(self, target, nick):
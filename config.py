@@ -7,12 +7,56 @@ config.py
 The Pump19 IRC Golem configuration loader.
 It reads configuratiom from environment variables and provides access to
 component specific dictionaries.
+Variables may also be set in a file named by PUMP19_CONFIG_FILE, which is
+reread whenever the configuration is reloaded (on SIGHUP). Reloading applies
+the cmd component, the IRC channels as well as TWITCH_API_URL,
+TWITCH_CLIENT_ID and LAST_FM_API_KEY. Everything else (including
+DATABASE_DSN) takes effect on restart only.
 
 Copyright (c) 2015 Twisted Pear <tp at pump19 dot eu>
 See the file LICENSE for copying permission.
 """
 
 from os import environ
+from tempfile import gettempdir
+
+
+def reload():
+    """
+    Update environment variables from the file named by PUMP19_CONFIG_FILE.
+    Each line of that file holds a single NAME=value pair, empty lines and
+    lines starting with # are ignored. Variables removed from the file since
+    the last reload get back the value they had before (or are unset).
+    Returns whether such a file has been configured.
+    """
+    config_file = environ.get("PUMP19_CONFIG_FILE")
+    if not config_file:
+        return False
+
+    variables = dict()
+    with open(config_file, encoding="utf-8") as config_lines:
+        for line in config_lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            (name, _, value) = line.partition("=")
+            variables[name.strip()] = value.strip()
+
+    for name in reload._original.keys() - variables.keys():
+        original = reload._original.pop(name)
+        if original is None:
+            environ.pop(name, None)
+        else:
+            environ[name] = original
+
+    for (name, value) in variables.items():
+        reload._original.setdefault(name, environ.get(name))
+        environ[name] = value
+
+    return True
+# maps names set from the file to their values from before (or None)
+reload._original = dict()
 
 
 def __get_irc_config():
@@ -33,8 +77,67 @@ def __get_irc_config():
 def __get_cmd_config():
     """Get a configuration dictionary for a CommandHandler instance."""
 
+    # map IRC channels to Twitch logins, e.g. "#channel=login;#other=login"
+    broadcaster_list = environ.get("PUMP19_CMD_BROADCASTERS", "")
+    broadcasters = dict()
+    for mapping in broadcaster_list.split(";"):
+        if not mapping.strip():
+            continue
+        (channel, _, login) = mapping.partition("=")
+        (channel, login) = (channel.strip(), login.strip())
+        if not channel or not login:
+            raise ValueError("Invalid PUMP19_CMD_BROADCASTERS entry \"{0}\", "
+                             "expected #channel=login.".format(mapping))
+        broadcasters[channel.lower()] = login.lower()
+
     return {"prefix": environ.get("PUMP19_CMD_PREFIX", "!"),
-            "override": environ.get("PUMP19_CMD_OVERRIDE")}
+            "override": environ.get("PUMP19_CMD_OVERRIDE"),
+            "broadcaster": environ.get("PUMP19_CMD_BROADCASTER",
+                                       "loadingreadyrun"),
+            "broadcasters": broadcasters,
+            "limit": int(environ.get("PUMP19_CMD_LIMIT", 2)),
+            "queue": int(environ.get("PUMP19_CMD_QUEUE", 4)),
+            "deadline": float(environ.get("PUMP19_CMD_DEADLINE", 15.0)),
+            "busy": environ.get("PUMP19_CMD_BUSY")}
+
+
+def __get_loop_config():
+    """Get a configuration dictionary for the event loop policy."""
+
+    return {"policy": environ.get("PUMP19_LOOP_POLICY", "auto")}
+
+
+def __get_lag_config():
+    """Get a configuration dictionary for a LagMonitor instance."""
+
+    return {"interval": float(environ.get("PUMP19_LAG_INTERVAL", 1.0)),
+            "threshold": float(environ.get("PUMP19_LAG_THRESHOLD", 0.1)),
+            "report": float(environ.get("PUMP19_LAG_REPORT", 300.0))}
+
+
+def __get_cache_config():
+    """Get a configuration dictionary for cache snapshots."""
+
+    return {"path": environ.get("PUMP19_CACHE_FILE"),
+            "interval": float(environ.get("PUMP19_CACHE_INTERVAL", 60.0))}
+
+
+def __get_debug_config():
+    """Get a configuration dictionary for on-demand diagnostics."""
+
+    return {"directory": environ.get("PUMP19_DEBUG_DIR", gettempdir()),
+            "duration": float(environ.get("PUMP19_PROFILE_DURATION", 30.0)),
+            "interval": float(environ.get("PUMP19_PROFILE_INTERVAL", 0.005))}
+
+
+def __get_coord_config():
+    """Get a configuration dictionary for a Coordinator instance."""
+
+    return {"enabled": True if "PUMP19_COORDINATION" in environ else False,
+            "wait": float(environ.get("PUMP19_COORD_WAIT", 5.0)),
+            "lease": float(environ.get("PUMP19_COORD_LEASE", 60.0)),
+            "timeout": float(environ.get("PUMP19_COORD_TIMEOUT", 1.0)),
+            "retry": float(environ.get("PUMP19_COORD_RETRY", 30.0))}
 
 
 def get_config(component):
@@ -42,11 +145,27 @@ def get_config(component):
     Get a configuration dictionary for a specific component.
     Valid components are:
     - irc
+    - cmd
+    - loop
+    - lag
+    - cache
+    - debug
+    - coord
     """
     if component == "irc":
         return __get_irc_config()
     elif component == "cmd":
         return __get_cmd_config()
+    elif component == "loop":
+        return __get_loop_config()
+    elif component == "lag":
+        return __get_lag_config()
+    elif component == "cache":
+        return __get_cache_config()
+    elif component == "debug":
+        return __get_debug_config()
+    elif component == "coord":
+        return __get_coord_config()
 
     # we don't know that config
     raise KeyError("No such component: {0}".format(component))
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+coordination.py
+
+Coordinate several golem instances through a shared Postgres database.
+Instances share rate limiter windows (so only one of them answers a command
+in a shared channel) and results of upstream queries. Only one instance at a
+time queries upstream for a key; it holds an expiring lease while doing so
+and notifies everyone else through LISTEN/NOTIFY once the result is stored.
+No database connection is held while querying upstream.
+
+Any database error makes the instance fall back to deciding on its own.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import collections
+import dbutils
+import json
+import logging
+import time
+import uuid
+
+NOTIFY_CHANNEL = "pump19_cache"
+
+SETUP_SQL = """
+CREATE TABLE IF NOT EXISTS pump19_limits (
+    name text PRIMARY KEY,
+    last double precision NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pump19_cache (
+    key text PRIMARY KEY,
+    stamp double precision NOT NULL,
+    value text NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pump19_leases (
+    key text PRIMARY KEY,
+    owner text NOT NULL,
+    expiry double precision NOT NULL
+);
+"""
+
+CLAIM_SQL = """
+INSERT INTO pump19_limits (name, last)
+VALUES (%(name)s, extract(epoch FROM clock_timestamp()))
+ON CONFLICT (name) DO UPDATE SET last = EXCLUDED.last
+WHERE pump19_limits.last < EXCLUDED.last - %(span)s
+RETURNING name;
+"""
+
+LEASE_SQL = """
+INSERT INTO pump19_leases (key, owner, expiry)
+VALUES (%(key)s, %(owner)s, extract(epoch FROM clock_timestamp()) + %(lease)s)
+ON CONFLICT (key) DO UPDATE
+SET owner = EXCLUDED.owner, expiry = EXCLUDED.expiry
+WHERE pump19_leases.expiry < extract(epoch FROM clock_timestamp())
+RETURNING key;
+"""
+
+UNLEASE_SQL = """
+DELETE FROM pump19_leases WHERE key = %(key)s AND owner = %(owner)s;
+"""
+
+SELECT_SQL = "SELECT stamp, value FROM pump19_cache WHERE key = %(key)s;"
+
+UPSERT_SQL = """
+INSERT INTO pump19_cache (key, stamp, value)
+VALUES (%(key)s, %(stamp)s, %(value)s)
+ON CONFLICT (key) DO UPDATE
+SET stamp = EXCLUDED.stamp, value = EXCLUDED.value;
+"""
+
+
+class Coordinator:
+    """
+    The coordinator shares limiter windows and cached upstream results
+    between instances connected to the same database.
+    """
+    logger = logging.getLogger("coordination")
+
+    def __init__(self, *, loop=None, wait=5.0, lease=60.0, timeout=1.0,
+                 retry=30.0):
+        """
+        Initialize the coordinator, the database is set up lazily.
+        Instances wait for each other's results for wait seconds, leases for
+        upstream queries expire after lease seconds and we don't wait longer
+        than timeout seconds for the database to set up or for a pooled
+        connection. Failed setups are retried after retry seconds.
+        """
+        self.logger.info("Creating Coordinator instance.")
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.wait = wait
+        self.lease = lease
+        self.timeout = timeout
+        self.retry = retry
+        self.owner = uuid.uuid4().hex
+        self.ready = None
+        self.retry_at = None
+        self.listener = None
+        # futures waiting for another instance to store a key
+        self.flights = collections.defaultdict(list)
+
+    async def prepare(self):
+        """
+        Create tables and start listening for notifications once.
+        Raises ConnectionError while waiting to retry a failed setup and
+        asyncio.TimeoutError if setting up takes longer than timeout seconds
+        (it goes on in the background).
+        """
+        if not self.ready:
+            if self.retry_at and self.loop.time() < self.retry_at:
+                raise ConnectionError("Database setup failed recently.")
+            self.ready = self.loop.create_task(self.setup())
+            self.ready.add_done_callback(self.check_setup)
+
+        await asyncio.wait_for(asyncio.shield(self.ready), self.timeout)
+
+    def check_setup(self, task):
+        """Retry a failed setup no sooner than retry seconds later."""
+        if task.cancelled():
+            error = "cancelled"
+        elif task.exception():
+            error = repr(task.exception())
+        else:
+            return
+
+        self.logger.error("Cannot set up coordination, retrying in {retry}s: "
+                          "{error}".format(retry=self.retry, error=error))
+        self.ready = None
+        self.retry_at = self.loop.time() + self.retry
+
+    async def setup(self):
+        """Create tables and start the listener."""
+        await self.query(SETUP_SQL)
+
+        # the listener keeps its connection for as long as it runs
+        pool = await asyncio.wait_for(
+                dbutils.get_pool(loop=self.loop), self.timeout)
+        conn = await asyncio.wait_for(pool.acquire(), self.timeout)
+        async with conn.cursor() as cur:
+            await cur.execute("LISTEN {0};".format(NOTIFY_CHANNEL))
+        self.listener = self.loop.create_task(self.listen(pool, conn))
+
+        self.logger.info("Coordinating through the database.")
+
+    async def listen(self, pool, conn):
+        """Wake up everyone waiting for a key another instance has stored."""
+        try:
+            while True:
+                notify = await conn.notifies.get()
+                for future in self.flights.pop(notify.payload, []):
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            pool.release(conn)
+            self.ready = None
+
+    def stop(self):
+        """Stop listening for notifications."""
+        if self.listener:
+            self.listener.cancel()
+
+    async def query(self, sql, params=None):
+        """
+        Execute a statement on a pooled connection.
+        Returns the first row of its result or None if there is none.
+        Raises asyncio.TimeoutError if no connection becomes available.
+        """
+        pool = await asyncio.wait_for(
+                dbutils.get_pool(loop=self.loop), self.timeout)
+        conn = await asyncio.wait_for(pool.acquire(), self.timeout)
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                if cur.description:
+                    return await cur.fetchone()
+                return None
+        finally:
+            pool.release(conn)
+
+    async def claim(self, name, span):
+        """
+        Claim a rate limiter window of span seconds for name.
+        Returns False if another instance has claimed it already.
+        """
+        try:
+            await self.prepare()
+            row = await self.query(CLAIM_SQL, {"name": name, "span": span})
+            return bool(row)
+        except Exception as e:
+            self.logger.error("Cannot claim {name}: {exc!r}".format(
+                name=name, exc=e))
+            return True
+
+    async def fetch(self, key, ttl, func, *args, **kwargs):
+        """
+        Get a value for key that is younger than ttl seconds, preferably one
+        stored by another instance. Otherwise query upstream, making sure only
+        one instance does.
+        Returns a tuple of the value's timestamp and the value.
+        """
+        queried = False
+        flight = self.loop.create_future()
+        try:
+            await self.prepare()
+            entry = await self.get(key)
+            if entry and time.time() - entry[0] < ttl:
+                return entry
+
+            # subscribe before taking the lease to not miss a notification
+            self.flights[key].append(flight)
+
+            if await self.query(LEASE_SQL, {"key": key, "owner": self.owner,
+                                            "lease": self.lease}):
+                try:
+                    # someone may have stored a value before we got the lease
+                    entry = await self.get(key)
+                    if entry and time.time() - entry[0] < ttl:
+                        return entry
+
+                    queried = True
+                    return await self.update(key, func, *args, **kwargs)
+                finally:
+                    await self.unlease(key)
+
+            # another instance is querying upstream, wait for its result
+            try:
+                await asyncio.wait_for(flight, self.wait)
+            except asyncio.TimeoutError:
+                self.logger.warning("Gave up waiting for {0}.".format(key))
+
+            entry = await self.get(key)
+            if entry and time.time() - entry[0] < ttl:
+                return entry
+        except Exception as e:
+            # only database errors make us query upstream on our own
+            if queried:
+                raise
+            self.logger.error("Cannot coordinate {key}: {exc!r}".format(
+                key=key, exc=e))
+        finally:
+            flights = self.flights.get(key, [])
+            if flight in flights:
+                flights.remove(flight)
+            if not flights:
+                self.flights.pop(key, None)
+
+        return (time.time(), await func(*args, **kwargs))
+
+    async def get(self, key):
+        """Get the shared timestamp and value for key or None."""
+        row = await self.query(SELECT_SQL, {"key": key})
+        if not row:
+            return None
+
+        (stamp, value) = row
+        return (stamp, json.loads(value))
+
+    async def update(self, key, func, *args, **kwargs):
+        """Query upstream, share the result and notify other instances."""
+        value = await func(*args, **kwargs)
+        stamp = time.time()
+
+        if value is None:
+            return (stamp, value)
+
+        # we got our value, failing to share it is no reason to lose it
+        try:
+            await self.query(UPSERT_SQL, {"key": key, "stamp": stamp,
+                                          "value": json.dumps(value)})
+            await self.query("SELECT pg_notify(%(channel)s, %(key)s);",
+                             {"channel": NOTIFY_CHANNEL, "key": key})
+        except Exception as e:
+            self.logger.error("Cannot share {key}: {exc!r}".format(
+                key=key, exc=e))
+
+        return (stamp, value)
+
+    async def unlease(self, key):
+        """Give up our lease for key."""
+        try:
+            await self.query(UNLEASE_SQL, {"key": key, "owner": self.owner})
+        except Exception as e:
+            self.logger.error("Cannot give up lease for {key}: {exc!r}".format(
+                key=key, exc=e))
@@ -5,6 +5,7 @@
 dbutils.py
 
 Various database driven utility functions.
+The pool connects to DATABASE_DSN as it is set when the pool is first used.
 
 Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
 See the file LICENSE for copying permission.
@@ -15,16 +16,19 @@ import aiopg
 
 from os import environ
 
-DSN = environ["DATABASE_DSN"]
-
 
 async def get_pool(loop=None):
+    # create the lock on first use so it uses the configured event loop
+    if not get_pool._lock:
+        get_pool._lock = asyncio.Lock()
+
     async with get_pool._lock:
         if not get_pool._pool:
+            dsn = environ.get("DATABASE_DSN")
             pool = await aiopg.create_pool(
-                    DSN, minsize=1, maxsize=5, loop=loop)
+                    dsn, minsize=1, maxsize=5, loop=loop)
             get_pool._pool = pool
 
         return get_pool._pool
 get_pool._pool = None
-get_pool._lock = asyncio.Lock()
+get_pool._lock = None
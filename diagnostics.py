@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+diagnostics.py
+
+On-demand diagnostics for a running golem.
+The profiler samples the event loop's stack from a separate thread for a
+limited time and writes the collected stacks in folded format (one line of
+semicolon separated frames and a sample count each), which flame graph tools
+understand. The task dump writes the stacks of all pending asyncio tasks.
+Neither stops the event loop.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import collections
+import linecache
+import logging
+import os
+import sys
+import threading
+import time
+
+
+def get_path(directory, kind):
+    """Get a timestamped path for a diagnostics file of some kind."""
+    name = "pump19-{kind}-{stamp}.txt".format(
+            kind=kind, stamp=time.strftime("%Y%m%d-%H%M%S"))
+    return os.path.join(directory, name)
+
+
+def get_await_chain(task):
+    """
+    Get the frames of every coroutine in a task's await chain, outermost
+    first. What the innermost one waits for is part of the task's repr.
+    Suspended coroutines don't link to the coroutines they await through
+    f_back, so the chain is followed through cr_await (or gi_yieldfrom).
+    """
+    frames = list()
+    awaited = task.get_coro()
+    while awaited is not None:
+        frame = (getattr(awaited, "cr_frame", None) or
+                 getattr(awaited, "gi_frame", None))
+        if frame is None:
+            break
+        frames.append(frame)
+        awaited = (getattr(awaited, "cr_await", None) or
+                   getattr(awaited, "gi_yieldfrom", None))
+
+    return frames
+
+
+def dump_tasks(directory, loop=None):
+    """Write the stacks of all pending tasks to a file."""
+    logger = logging.getLogger("diagnostics")
+
+    loop = loop or asyncio.get_event_loop()
+    tasks = list(asyncio.all_tasks(loop))
+
+    path = get_path(directory, "tasks")
+    with open(path, "w", encoding="utf-8") as dump:
+        dump.write("{0} pending task(s)\n".format(len(tasks)))
+        for task in tasks:
+            dump.write("\n{0!r}\n".format(task))
+            for frame in get_await_chain(task):
+                code = frame.f_code
+                dump.write("  File \"{0}\", line {1}, in {2}\n".format(
+                    code.co_filename, frame.f_lineno, code.co_name))
+                source = linecache.getline(code.co_filename, frame.f_lineno)
+                if source:
+                    dump.write("    {0}\n".format(source.strip()))
+
+    logger.info("Dumped {nof} pending task(s) to {path}.".format(
+        nof=len(tasks), path=path))
+
+
+class Profiler:
+    """
+    The profiler samples the stack of the thread running the event loop.
+    Only one profile can be taken at a time.
+    """
+    logger = logging.getLogger("diagnostics")
+
+    def __init__(self, *, directory, duration=30.0, interval=0.005):
+        """Initialize the profiler."""
+        self.directory = directory
+        self.duration = duration
+        self.interval = interval
+        self.thread = None
+
+    def start(self):
+        """
+        Start profiling the calling thread.
+        Call this from the event loop (e.g. from a signal handler).
+        """
+        if self.thread and self.thread.is_alive():
+            self.logger.warning("Profiler is already running.")
+            return
+
+        self.logger.info("Profiling event loop for {0}s.".format(
+            self.duration))
+
+        self.thread = threading.Thread(
+                target=self.run, args=(threading.get_ident(),),
+                name="profiler", daemon=True)
+        self.thread.start()
+
+    def run(self, ident):
+        """Sample the stack of the thread with the given ident."""
+        stacks = collections.Counter()
+        deadline = time.monotonic() + self.duration
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                break
+
+            stack = list()
+            while frame:
+                code = frame.f_code
+                stack.append("{name} ({filename}:{lineno})".format(
+                    name=code.co_name,
+                    filename=os.path.basename(code.co_filename),
+                    lineno=code.co_firstlineno))
+                frame = frame.f_back
+            del frame
+
+            stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+        path = get_path(self.directory, "profile")
+        try:
+            with open(path, "w", encoding="utf-8") as profile:
+                for (stack, samples) in stacks.most_common():
+                    profile.write("{0} {1}\n".format(stack, samples))
+        except OSError as e:
+            self.logger.error("Cannot write profile: {0}".format(e))
+            return
+
+        self.logger.info("Wrote {nof} samples to {path}.".format(
+            nof=sum(stacks.values()), path=path))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+dice.py
+
+A dice engine for the !roll command.
+Small rolls are sampled die by die. Large rolls are drawn directly from the
+distribution of their sum (or of the order statistic splitting kept from
+dropped dice), so every roll completes in bounded time and memory.
+
+Running this file directly performs a small benchmark.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import collections
+import math
+import random
+
+# rolls with up to this many dice are sampled die by die
+SAMPLE_LIMIT = 100
+# anything above a googol is just silly (and overflows floating point math)
+MAX_VALUE = 10 ** 100
+
+Roll = collections.namedtuple("Roll", ["total", "dice", "dropped"])
+
+
+def _face(u, sides):
+    """Map a variate u from [0, 1] to a face of a die with given sides."""
+    return min(int(u * sides) + 1, sides)
+
+
+def _sum_faces(count, sides, low, rng):
+    """
+    Sum up count dice whose underlying uniform variates are restricted to the
+    interval [low, 1].
+    """
+    if count <= 0:
+        return 0
+
+    if count <= SAMPLE_LIMIT:
+        return sum(_face(low + (1.0 - low) * rng.random(), sides)
+                   for _ in range(count))
+
+    first = _face(low, sides)
+    if first == sides:
+        return count * sides
+
+    # the lowest face is only partially covered by [low, 1], faces above are
+    # equally likely, hence compute moments relative to the lowest face
+    span = sides * (1.0 - low)
+    upper = sides - first
+    weight = 1.0 / span
+    mean = weight * upper * (upper + 1) / 2
+    square = weight * upper * (upper + 1) * (2 * upper + 1) / 6
+    variance = max(square - mean * mean, 0.0)
+
+    deviation = math.sqrt(count * variance) * rng.gauss(0.0, 1.0)
+    total = count * first + int(round(count * mean + deviation))
+
+    return min(max(total, count * first), count * sides)
+
+
+def _sum_highest(count, sides, keep, rng):
+    """Sum up the keep highest of count dice without sampling each die."""
+    if keep <= 0:
+        return 0
+    if keep >= count:
+        return _sum_faces(count, sides, 0.0, rng)
+
+    # the lowest kept variate is the (count - keep + 1)th order statistic of
+    # count uniform variates, all other kept ones are uniform above it
+    low = rng.betavariate(count - keep + 1, keep)
+    return _face(low, sides) + _sum_faces(keep - 1, sides, low, rng)
+
+
+def selection(count, selector, amount):
+    """
+    Translate a roll selector (kh, kl, dh, dl, k or d) and its amount into
+    the number of kept dice and whether the lowest dice are kept.
+    A bare k keeps the highest dice, a bare d drops the lowest dice.
+    """
+    if not selector:
+        return (count, False)
+
+    amount = min(amount, count)
+    if selector in ("k", "kh"):
+        return (amount, False)
+    elif selector == "kl":
+        return (amount, True)
+    elif selector in ("d", "dl"):
+        return (count - amount, False)
+    elif selector == "dh":
+        return (count - amount, True)
+
+    raise ValueError("No such selector: {0}".format(selector))
+
+
+def roll(count, sides, *, keep=None, lowest=False, modifier=0, rng=None):
+    """
+    Roll count dice with the given number of sides.
+    Only the keep highest (or lowest) dice are summed up and the modifier is
+    added to the sum.
+    Returns a Roll tuple of the total, the individual dice and the indices of
+    the dropped dice. Both are None whenever the dice were not sampled one by
+    one.
+    """
+    if not 0 < count <= MAX_VALUE:
+        raise ValueError("Dice count must be between 1 and 10^100.")
+    if not 0 < sides <= MAX_VALUE:
+        raise ValueError("Dice sides must be between 1 and 10^100.")
+    if not -MAX_VALUE <= modifier <= MAX_VALUE:
+        raise ValueError("Modifier must be between -10^100 and 10^100.")
+
+    rng = rng or random
+    keep = count if keep is None else min(max(keep, 0), count)
+
+    if count <= SAMPLE_LIMIT:
+        dice = tuple(rng.randint(1, sides) for _ in range(count))
+        order = sorted(range(count), key=dice.__getitem__,
+                       reverse=not lowest)
+        total = sum(dice[index] for index in order[:keep])
+        return Roll(total + modifier, dice, frozenset(order[keep:]))
+
+    if sides == 1:
+        return Roll(keep + modifier, None, None)
+
+    # the lowest dice are the highest of mirrored dice (sides + 1 - face)
+    total = _sum_highest(count, sides, keep, rng)
+    if lowest:
+        total = keep * (sides + 1) - total
+
+    return Roll(total + modifier, None, None)
+
+
+if __name__ == "__main__":
+    import timeit
+
+    for (count, sides, keep) in ((3, 6, None), (100, 6, None),
+                                 (1000000, 1000000, None),
+                                 (1000000, 1000000, 3),
+                                 (1000000, 1000000, 999997),
+                                 (10 ** 100, 10 ** 100, 10 ** 99)):
+        number = 10000
+        seconds = timeit.timeit(
+                lambda: roll(count, sides, keep=keep), number=number)
+        print("{count:.3g}d{sides:.3g} keep {keep}: {usec:.2f} us/roll".format(
+            count=count, sides=sides,
+            keep="{0:.3g}".format(keep) if keep else "all",
+            usec=seconds / number * 1e6))
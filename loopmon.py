@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+loopmon.py
+
+Event loop selection and loop lag monitoring.
+The lag monitor measures how late the event loop wakes up a sleeping
+coroutine. A watchdog thread inspects the loop's thread whenever it is late
+and remembers the code that blocked the loop for the longest time.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+
+POLICIES = ("auto", "asyncio", "uvloop")
+
+
+def install_policy(policy="auto"):
+    """
+    Install an event loop policy.
+    Valid policies are:
+    - asyncio (the default asyncio event loop)
+    - uvloop (requires the uvloop module)
+    - auto (uvloop if installed, asyncio otherwise)
+    Returns the name of the policy that has actually been installed.
+    """
+    logger = logging.getLogger("loopmon")
+
+    if policy not in POLICIES:
+        logger.warning("No such event loop policy: {0}.".format(policy))
+        policy = "auto"
+
+    if policy == "asyncio":
+        return "asyncio"
+
+    try:
+        import uvloop
+    except ImportError:
+        if policy == "uvloop":
+            logger.warning("uvloop is not installed, falling back to asyncio.")
+        return "asyncio"
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+class LagMonitor:
+    """
+    The lag monitor periodically samples event loop scheduling delay.
+    It logs every delay exceeding a threshold and reports statistics along
+    with the longest blocking coroutine or callback in regular intervals.
+    """
+    logger = logging.getLogger("loopmon")
+
+    def __init__(self, *, loop=None, interval=1.0, threshold=0.1,
+                 report=300.0):
+        """Initialize the lag monitor."""
+        self.logger.info("Creating LagMonitor instance.")
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self.threshold = threshold
+        self.report = report
+
+        self.lock = threading.Lock()
+        self.halt = threading.Event()
+        self.watchdog = None
+        self.task = None
+
+        # written by the loop's thread, read by the watchdog
+        self.ident = None
+        self.beat = None
+
+        self.reset()
+
+    def reset(self):
+        """Reset the statistics of the current reporting period."""
+        self.samples = 0
+        self.total = 0.0
+        self.worst = 0.0
+        with self.lock:
+            self.blocked = (0.0, None)
+
+    def start(self):
+        """Start sampling the event loop."""
+        self.logger.info(
+                "Monitoring loop lag every {interval}s "
+                "(threshold {threshold}s, report every {report}s).".format(
+                    interval=self.interval, threshold=self.threshold,
+                    report=self.report))
+
+        self.halt.clear()
+        self.task = self.loop.create_task(self.sample())
+        self.watchdog = threading.Thread(
+                target=self.watch, name="loopmon", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        """Stop sampling the event loop."""
+        self.logger.info("Stopping loop lag monitor.")
+        self.log_report()
+        self.halt.set()
+        if self.task:
+            self.task.cancel()
+
+    async def sample(self):
+        """Measure how late the event loop wakes us up."""
+        self.ident = threading.get_ident()
+        last_report = time.monotonic()
+
+        while not self.halt.is_set():
+            before = time.monotonic()
+            with self.lock:
+                self.beat = before
+            await asyncio.sleep(self.interval)
+            after = time.monotonic()
+
+            lag = max(after - before - self.interval, 0.0)
+            self.samples += 1
+            self.total += lag
+            self.worst = max(self.worst, lag)
+
+            if lag > self.threshold:
+                self.logger.warning(
+                        "Event loop lagged {0:.0f} ms.".format(lag * 1000))
+
+            if after - last_report >= self.report:
+                self.log_report()
+                self.reset()
+                last_report = after
+
+    def log_report(self):
+        """Log statistics of the current reporting period."""
+        if not self.samples:
+            return
+
+        with self.lock:
+            (duration, culprit) = self.blocked
+
+        self.logger.info(
+                "Loop lag over {samples} samples: mean {mean:.1f} ms, "
+                "max {worst:.1f} ms.".format(
+                    samples=self.samples,
+                    mean=self.total / self.samples * 1000,
+                    worst=self.worst * 1000))
+        if culprit:
+            self.logger.info(
+                    "Longest block of {0:.0f} ms in {1}.".format(
+                        duration * 1000, culprit))
+
+    def watch(self):
+        """Inspect the event loop's thread while it is late."""
+        while not self.halt.wait(self.threshold):
+            with self.lock:
+                beat = self.beat
+            if beat is None:
+                continue
+
+            stall = time.monotonic() - beat - self.interval
+            if stall < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+            culprit = self.describe(frame)
+            del frame
+
+            with self.lock:
+                if stall > self.blocked[0]:
+                    self.blocked = (stall, culprit)
+
+    @staticmethod
+    def describe(frame):
+        """
+        Describe what is running in a frame's stack.
+        Prefers the outermost coroutine, which usually is the task's entry
+        point (e.g. a command handler), and falls back to the innermost frame.
+        """
+        innermost = frame
+        coroutine = None
+        while frame:
+            if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                coroutine = frame
+            frame = frame.f_back
+
+        def where(frame):
+            return "{name} ({filename}:{lineno})".format(
+                    name=frame.f_code.co_name,
+                    filename=os.path.basename(frame.f_code.co_filename),
+                    lineno=frame.f_lineno)
+
+        if coroutine and coroutine is not innermost:
+            return "coroutine {0} at {1}".format(
+                    where(coroutine), where(innermost))
+        elif coroutine:
+            return "coroutine {0}".format(where(coroutine))
+
+        return "callback {0}".format(where(innermost))
@@ -25,7 +25,6 @@ class Protocol:
     """IRC client class."""
     logger = logging.getLogger("protocol")
     restart = True
-    msglock = asyncio.Lock()
 
     def __init__(self, *,
                  hostname="localhost", port=6667, ssl=False,
@@ -36,6 +35,7 @@ class Protocol:
         """
         self.logger.info("Creating Protocol instance.")
 
+        self.hostname = hostname
         self.nickname = nickname
         self.password = password
         self.username = username
@@ -44,6 +44,8 @@ class Protocol:
 
         self.logger.debug("Registering callback methods.")
         self.irc = bottom.Client(hostname, port, ssl=ssl)
+        # create the lock here so it uses the configured event loop policy
+        self.msglock = asyncio.Lock()
 
         self.event_handler("PING")(self.keepalive)
         self.event_handler("CLIENT_CONNECT")(self.register)
@@ -118,6 +120,27 @@ class Protocol:
         for channel in self.channels:
             self.irc.send("JOIN", channel=channel)
 
+    def update_channels(self, channels):
+        """
+        Update the list of configured channels.
+        Only channels that have been added or removed are joined or parted.
+        """
+        joined = [channel for channel in channels
+                  if channel not in self.channels]
+        parted = [channel for channel in self.channels
+                  if channel not in channels]
+        self.channels = list(channels)
+
+        if parted:
+            self.logger.info("Parting channels {0}.".format(",".join(parted)))
+        for channel in parted:
+            self.irc.send("PART", channel=channel)
+
+        if joined:
+            self.logger.info("Joining channels {0}.".format(",".join(joined)))
+        for channel in joined:
+            self.irc.send("JOIN", channel=channel)
+
     async def reconnect(self):
         """Reconnect after losing the connection to the network."""
         if self.restart:
@@ -12,42 +12,135 @@ See the file LICENSE for copying permission.
 """
 
 import asyncio
+import cache
 import command
 import config
+import coordination
+import diagnostics
 import logging
+import loopmon
 import protocol
 import signal
 
 LOG_FORMAT = "{levelname}({name}): {message}"
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, style="{")
 
+# components that are only configured on startup
+RESTART_COMPONENTS = ("irc", "loop", "lag", "cache", "debug", "coord")
+
+
+def get_restart_config():
+    """Get the configuration of components that reloading doesn't apply."""
+    restart_config = {component: config.get_config(component)
+                      for component in RESTART_COMPONENTS}
+    # channels are joined and parted on reload
+    del restart_config["irc"]["channels"]
+
+    return restart_config
+
 
 def main():
     logger = logging.getLogger("pump19")
     logger.info("Pump19 started.")
 
+    if config.reload():
+        logger.info("Loaded configuration file.")
+    restart_config = get_restart_config()
+
+    loop_config = config.get_config("loop")
+    policy = loopmon.install_policy(**loop_config)
+    logger.info("Using {0} event loop.".format(policy))
+
     client_config = config.get_config("irc")
     client = protocol.Protocol(**client_config)
     loop = client.loop
 
+    # serve results from before the restart until fresh ones arrive
+    cache_config = config.get_config("cache")
+    snapshot = cache_config["path"]
+    persister = None
+    if snapshot:
+        cache.store.load(snapshot)
+        persister = loop.create_task(cache.store.persist(**cache_config))
+
+    # share limiter windows and upstream results with other instances
+    coord_config = config.get_config("coord")
+    coordinator = None
+    if coord_config["enabled"]:
+        coordinator = coordination.Coordinator(
+                loop=loop, wait=coord_config["wait"],
+                lease=coord_config["lease"], timeout=coord_config["timeout"],
+                retry=coord_config["retry"])
+        cache.store.backend = coordinator
+
     cmdhdl_config = config.get_config("cmd")
-    # we don't need to remember this instance
-    command.CommandHandler(client, loop=loop, **cmdhdl_config)
+    cmdhdl = command.CommandHandler(
+            client, loop=loop, backend=coordinator, **cmdhdl_config)
+
+    # a non-positive interval disables the loop lag monitor
+    lag_config = config.get_config("lag")
+    monitor = None
+    if lag_config["interval"] > 0:
+        monitor = loopmon.LagMonitor(loop=loop, **lag_config)
 
     def shutdown():
         logger.info("Shutdown signal received.")
+        if monitor:
+            monitor.stop()
+        if persister:
+            persister.cancel()
+        if coordinator:
+            coordinator.stop()
         client.shutdown()
     loop.add_signal_handler(signal.SIGTERM, shutdown)
 
+    def reload():
+        logger.info("Reload signal received.")
+        # keep running with the old configuration if anything goes wrong
+        try:
+            config.reload()
+            client_config = config.get_config("irc")
+            cmdhdl_config = config.get_config("cmd")
+            reloaded_config = get_restart_config()
+            cmdhdl.reload(**cmdhdl_config)
+        except Exception:
+            logger.exception("Reload failed.")
+            return
+        client.update_channels(client_config["channels"])
+
+        for (component, component_config) in reloaded_config.items():
+            if component_config != restart_config[component]:
+                logger.warning("Changes to the {0} configuration take effect "
+                               "on restart.".format(component))
+    loop.add_signal_handler(signal.SIGHUP, reload)
+
+    # profile the event loop or dump pending tasks on demand
+    debug_config = config.get_config("debug")
+    profiler = diagnostics.Profiler(**debug_config)
+    loop.add_signal_handler(signal.SIGUSR1, profiler.start)
+
+    def dump():
+        diagnostics.dump_tasks(debug_config["directory"], loop)
+        cmdhdl.executor.log_counters()
+    loop.add_signal_handler(signal.SIGUSR2, dump)
+
     logger.info("Running protocol activity.")
     client.start()
+    if monitor:
+        monitor.start()
     loop.run_forever()
 
     # before we stop the event loop, make sure all tasks are done
-    pending = asyncio.Task.all_tasks(loop)
+    pending = asyncio.all_tasks(loop)
     if pending:
         loop.run_until_complete(asyncio.wait(pending, timeout=5))
 
+    if snapshot:
+        try:
+            cache.store.save(snapshot)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("Cannot save cache snapshot: {0}".format(e))
+
     loop.close()
     logger.info("Protocol activity ceased.")
     logger.info("Exiting...")
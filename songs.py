@@ -5,6 +5,7 @@
 songs.py
 
 Utilities for querying Last.fm
+The API key is read from LAST_FM_API_KEY on every request.
 
 Copyright (c) 2015 Twisted Pear <tp at pump19 dot eu>
 See the file LICENSE for copying permission.
@@ -16,15 +17,15 @@ import xml.etree.ElementTree as ET
 from os import environ
 from urllib.parse import urlencode
 
-LAST_FM_API_KEY = environ["LAST_FM_API_KEY"]
 LAST_FM_API_URL = "http://ws.audioscrobbler.com/2.0/"
 
 
 async def get_lastfm_info(user_name, loop=None):
     """Get information on a last.fm user."""
+    api_key = environ["LAST_FM_API_KEY"]
     info_qs = urlencode({"method": "user.getInfo",
                          "user": user_name,
-                         "api_key": LAST_FM_API_KEY})
+                         "api_key": api_key})
     info_url = "{url}?{qs}".format(url=LAST_FM_API_URL, qs=info_qs)
     info_response = await aiohttp.request("GET", info_url, loop=loop)
     if info_response.status is not 200:
@@ -41,7 +42,7 @@ async def get_lastfm_info(user_name, loop=None):
     song_qs = urlencode({"method": "user.getRecentTracks",
                          "user": user_name,
                          "limit": 1,
-                         "api_key": LAST_FM_API_KEY})
+                         "api_key": api_key})
     song_url = "{url}?{qs}".format(url=LAST_FM_API_URL, qs=song_qs)
     song_response = await aiohttp.request("GET", song_url, loop=loop)
     if song_response.status is not 200:
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_cache.py
+
+Test the upstream query cache and its snapshots.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import cache
+import os
+import tempfile
+import time
+import unittest
+
+
+class CachedTest(unittest.TestCase):
+    """Serve cached results of a counting upstream query."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.cache = cache.Cache()
+        self.calls = list()
+        self.query = self.cache.cached(
+                "query", ttl=60, max_age=600, timeout=1.0)(self.upstream)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def upstream(self, name):
+        self.calls.append(name)
+        await asyncio.sleep(0.01)
+        return None if name == "nobody" else name.upper()
+
+    def put(self, name, value, age):
+        key = self.cache.make_key("query", (name,))
+        self.cache.put(key, value, time.time() - age)
+
+    def get(self, name):
+        return self.cache.get(self.cache.make_key("query", (name,)))
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_fresh(self):
+        self.put("user", "CACHED", 30)
+
+        self.assertEqual(self.run_coro(self.query("user")), "CACHED")
+        self.assertEqual(self.calls, [])
+
+    def test_stale(self):
+        self.put("user", "STALE", 120)
+
+        # the stale value is served at once and refreshed in the background
+        self.assertEqual(self.run_coro(self.query("user")), "STALE")
+        self.assertEqual(len(self.cache.pending), 1)
+        self.run_coro(asyncio.sleep(0.05))
+
+        self.assertEqual(self.get("user").value, "USER")
+        self.assertEqual(self.run_coro(self.query("user")), "USER")
+        self.assertEqual(self.calls, ["user"])
+
+    def test_expired(self):
+        self.put("user", "EXPIRED", 601)
+
+        self.assertEqual(self.run_coro(self.query("user")), "USER")
+        self.assertEqual(self.calls, ["user"])
+
+    def test_single_flight(self):
+        results = self.run_coro(asyncio.gather(
+            self.query("user"), self.query("user")))
+
+        self.assertEqual(results, ["USER", "USER"])
+        self.assertEqual(self.calls, ["user"])
+
+    def test_none_discards(self):
+        self.put("nobody", "EXPIRED", 601)
+
+        self.assertIsNone(self.run_coro(self.query("nobody")))
+        self.assertIsNone(self.get("nobody"))
+
+    def test_timeout(self):
+        slow = self.cache.cached("slow", ttl=60, timeout=0.001)(self.upstream)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_coro(slow("user"))
+
+
+class SnapshotTest(unittest.TestCase):
+    """Save and load cache snapshots."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.json")
+
+    def test_round_trip(self):
+        stored = cache.Cache()
+        stored.put("old", {"value": 1}, time.time() - 3600)
+        stored.put("new", ["value", 2])
+        stored.save(self.path)
+
+        loaded = cache.Cache()
+        loaded.load(self.path)
+
+        self.assertEqual(loaded.entries, stored.entries)
+        self.assertEqual(list(loaded.entries), ["old", "new"])
+
+    def test_expired(self):
+        stored = cache.Cache()
+        stored.put("old", 1, time.time() - 7200)
+        stored.put("new", 2)
+        stored.save(self.path)
+
+        loaded = cache.Cache(max_age=3600)
+        loaded.load(self.path)
+
+        self.assertEqual(list(loaded.entries), ["new"])
+
+    def test_malformed(self):
+        with open(self.path, "w", encoding="utf-8") as snapshot:
+            snapshot.write('5\n["key"]\n[[1], 1e12, 1]\n["key", "x", 1]\n'
+                           '{"not": "json"\n["good", 1e12, 1]\n')
+
+        loaded = cache.Cache()
+        loaded.load(self.path)
+
+        self.assertEqual(list(loaded.entries), ["good"])
+
+    def test_unserializable(self):
+        stored = cache.Cache()
+        stored.put("bad", object())
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        persister = loop.create_task(stored.persist(self.path, 0.001))
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+        # failing to save doesn't stop saving later on
+        self.assertFalse(persister.done())
+        stored.discard("bad")
+        loop.run_until_complete(asyncio.sleep(0.01))
+        persister.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+
+        loaded = cache.Cache()
+        loaded.load(self.path)
+        self.assertEqual(loaded.entries, stored.entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
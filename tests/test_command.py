@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_command.py
+
+Test the command handler against a fake IRC client and Twitch client.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import unittest
+
+from unittest import mock
+
+# the monetary locale set up on import isn't needed (nor always installed)
+with mock.patch("locale.setlocale"):
+    import command
+
+
+class FakeClient:
+    """An IRC client recording sent messages."""
+    hostname = "irc.example.org"
+    nickname = "pump19"
+
+    def __init__(self):
+        self.messages = list()
+        self.msglock = asyncio.Lock()
+
+    def event_handler(self, command):
+        return lambda func: func
+
+    async def privmsg(self, target, message):
+        self.messages.append((target, message))
+
+
+class FakeTwitch:
+    """A Twitch client resolving logins from a dictionary."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.requests = list()
+
+    async def get_ids(self, logins):
+        self.requests.append(sorted(logins))
+        return {login: self.ids.get(login) for login in logins}
+
+    async def get_id(self, login):
+        return (await self.get_ids([login]))[login]
+
+
+class BroadcasterTest(unittest.TestCase):
+    """Look up the broadcasters associated with channels."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.handler = command.CommandHandler(
+                FakeClient(), loop=self.loop, broadcaster="loadingreadyrun",
+                broadcasters={"#pear": "twistedpear", "#nope": "nobody"})
+        self.handler.twitch = FakeTwitch({"loadingreadyrun": "27132299",
+                                          "twistedpear": "19"})
+        # let the handler resolve its broadcasters
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_get_broadcaster(self):
+        self.assertEqual(self.handler.get_broadcaster("#Pear"), "twistedpear")
+        self.assertEqual(self.handler.get_broadcaster("#lrr"),
+                         "loadingreadyrun")
+        self.assertEqual(self.handler.get_broadcaster("somebody"),
+                         "loadingreadyrun")
+
+    def test_resolve_broadcasters(self):
+        with self.assertLogs("command", "WARNING") as logs:
+            self.loop.run_until_complete(self.handler.resolve_broadcasters())
+
+        # all broadcasters are resolved at once
+        self.assertEqual(self.handler.twitch.requests[-1],
+                         ["loadingreadyrun", "nobody", "twistedpear"])
+        self.assertIn("nobody", logs.output[0])
+
+
+class FakeBackend:
+    """A coordination backend recording claims, granting unclaimed ones."""
+
+    def __init__(self, *claimed):
+        self.claimed = set(claimed)
+        self.claims = list()
+
+    async def claim(self, name, span):
+        self.claims.append(name)
+        return name not in self.claimed
+
+
+class LimiterTest(unittest.TestCase):
+    """Suppress repeated commands per target."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.client = FakeClient()
+        self.backend = FakeBackend(
+                "irc.example.org/#claimed/handle_command_bingo")
+        self.handler = command.CommandHandler(
+                self.client, loop=self.loop, backend=self.backend)
+        self.handler.twitch = FakeTwitch({})
+
+        # windows are kept by the class wide wrappers
+        windows = command.CommandHandler.handle_command_bingo._spam_last
+        self.addCleanup(windows.clear)
+        windows.clear()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def bingo(self, *targets):
+        for target in targets:
+            self.loop.run_until_complete(
+                    self.handler.handle_command_bingo(target, "somebody"))
+        return [target for (target, _) in self.client.messages]
+
+    def test_per_target(self):
+        with self.assertLogs("command.limiter", "WARNING") as logs:
+            self.assertEqual(self.bingo("#a", "#b", "#a"), ["#a", "#b"])
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("#a", logs.output[0])
+
+    def test_claims(self):
+        with self.assertLogs("command.limiter", "WARNING"):
+            self.assertEqual(self.bingo("#a", "#claimed"), ["#a"])
+
+        self.assertEqual(self.backend.claims, [
+            "irc.example.org/#a/handle_command_bingo",
+            "irc.example.org/#claimed/handle_command_bingo"])
+
+
+class ExecutorTest(unittest.TestCase):
+    """Run, queue and shed calls in the command executor."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.executor = command.CommandHandler.CommandExecutor(
+                limit=2, queue=2, deadline=1.0, loop=self.loop)
+        self.event = asyncio.Event()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def blocked(self):
+        await self.event.wait()
+
+    def start(self, func=None):
+        task = self.loop.create_task(
+                self.executor.run("cmd", func or self.blocked))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        return task
+
+    def finish(self, *tasks):
+        self.event.set()
+        return self.loop.run_until_complete(asyncio.gather(*tasks))
+
+    def test_limit(self):
+        tasks = [self.start() for _ in range(3)]
+
+        self.assertEqual(self.executor.running["cmd"], 2)
+        self.assertEqual(len(self.executor.waiters["cmd"]), 1)
+
+        self.assertEqual(self.finish(*tasks), [True, True, True])
+        self.assertEqual(self.executor.running["cmd"], 0)
+        self.assertEqual(self.executor.counters, {("cmd", "completed"): 3})
+
+    def test_queue_full(self):
+        tasks = [self.start() for _ in range(5)]
+
+        self.assertEqual(self.finish(*tasks), [True, True, True, True, False])
+        self.assertEqual(self.executor.counters, {("cmd", "completed"): 4,
+                                                  ("cmd", "shed"): 1})
+
+    def test_cancelled_waiter(self):
+        tasks = [self.start() for _ in range(3)]
+        tasks[2].cancel()
+
+        self.finish(*tasks[:2])
+        self.assertEqual(self.executor.running["cmd"], 0)
+        self.assertFalse(self.executor.waiters["cmd"])
+
+    def test_cancelled_after_hand_off(self):
+        # hold both slots without running anything
+        for _ in range(2):
+            self.loop.run_until_complete(self.executor.acquire("cmd", 1.0))
+        task = self.start()
+
+        # hand a slot over and cancel the waiter before it wakes up
+        self.executor.release("cmd")
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+        self.assertEqual(self.executor.running["cmd"], 1)
+
+        self.executor.release("cmd")
+        self.assertEqual(self.executor.running["cmd"], 0)
+
+    def test_waiter_timeout(self):
+        self.executor.deadline = 0.01
+        tasks = [self.start() for _ in range(3)]
+        self.assertFalse(self.loop.run_until_complete(tasks[2]))
+
+        self.finish(*tasks[:2])
+        self.assertEqual(self.executor.running["cmd"], 0)
+        self.assertEqual(self.executor.counters, {("cmd", "expired"): 2,
+                                                  ("cmd", "shed"): 1})
+
+    def test_slot_after_deadline(self):
+        async def late(name, timeout):
+            await asyncio.sleep(timeout)
+            self.executor.running[name] += 1
+            return True
+
+        self.executor.deadline = 0.01
+        self.executor.acquire = late
+        self.assertFalse(self.finish(self.start()).pop())
+
+        self.assertEqual(self.executor.running["cmd"], 0)
+        self.assertEqual(self.executor.counters, {("cmd", "shed"): 1})
+
+    def test_expired_and_failed(self):
+        async def failing():
+            raise RuntimeError("failed")
+
+        self.executor.deadline = 0.01
+        with self.assertLogs("command.executor"):
+            results = self.loop.run_until_complete(asyncio.gather(
+                self.executor.run("cmd", self.blocked),
+                self.executor.run("cmd", failing)))
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.executor.running["cmd"], 0)
+        self.assertEqual(self.executor.counters, {("cmd", "expired"): 1,
+                                                  ("cmd", "failed"): 1})
+
+    def test_log_counters(self):
+        self.finish(self.start())
+
+        with self.assertLogs("command.executor") as logs:
+            self.executor.log_counters()
+        self.assertEqual(logs.output,
+                         ["INFO:command.executor:cmd: 1 completed."])
+
+
+class BusyTest(unittest.TestCase):
+    """Reply to commands that have been shed."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.client = FakeClient()
+        self.handler = command.CommandHandler(
+                self.client, loop=self.loop, prefix="!",
+                limit=0, queue=0, busy="Busy, try again later.")
+        self.handler.twitch = FakeTwitch({})
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_busy(self):
+        with self.assertLogs("command.executor", "WARNING"):
+            self.loop.run_until_complete(self.handler.handle_privmsg(
+                nick="somebody", target="#lrr", message="!bingo"))
+
+        self.assertEqual(self.client.messages,
+                         [("#lrr", "Busy, try again later.")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_config.py
+
+Test reloading the configuration file.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import config
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+
+class ReloadTest(unittest.TestCase):
+    """Reload variables from a configuration file."""
+
+    def setUp(self):
+        (handle, self.path) = tempfile.mkstemp()
+        os.close(handle)
+
+        patcher = mock.patch.dict(os.environ, {
+            "PUMP19_CONFIG_FILE": self.path,
+            "PUMP19_CMD_PREFIX": "!"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop("PUMP19_CMD_BUSY", None)
+
+        patcher = mock.patch.dict(config.reload._original, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, *lines):
+        with open(self.path, "w", encoding="utf-8") as config_file:
+            config_file.write("\n".join(lines) + "\n")
+
+    def test_no_file(self):
+        del os.environ["PUMP19_CONFIG_FILE"]
+        self.assertFalse(config.reload())
+
+    def test_set(self):
+        self.write("# a comment", "", "PUMP19_CMD_PREFIX = &",
+                   "PUMP19_CMD_BUSY=Busy = busy.")
+
+        self.assertTrue(config.reload())
+        self.assertEqual(os.environ["PUMP19_CMD_PREFIX"], "&")
+        self.assertEqual(os.environ["PUMP19_CMD_BUSY"], "Busy = busy.")
+
+    def test_restore(self):
+        self.write("PUMP19_CMD_PREFIX=&", "PUMP19_CMD_BUSY=Busy.")
+        config.reload()
+
+        self.write("PUMP19_CMD_PREFIX=?")
+        config.reload()
+        self.assertEqual(os.environ["PUMP19_CMD_PREFIX"], "?")
+        self.assertNotIn("PUMP19_CMD_BUSY", os.environ)
+
+        # the value from before the first reload is restored
+        self.write("")
+        config.reload()
+        self.assertEqual(os.environ["PUMP19_CMD_PREFIX"], "!")
+        self.assertEqual(config.get_config("cmd")["prefix"], "!")
+        self.assertEqual(config.reload._original, {})
+
+
+class CommandConfigTest(unittest.TestCase):
+    """Parse the command handler configuration."""
+
+    def get_broadcasters(self, broadcaster_list):
+        with mock.patch.dict(os.environ,
+                             {"PUMP19_CMD_BROADCASTERS": broadcaster_list}):
+            return config.get_config("cmd")["broadcasters"]
+
+    def test_broadcasters(self):
+        self.assertEqual(self.get_broadcasters(""), {})
+        self.assertEqual(
+                self.get_broadcasters("#LRR=LoadingReadyRun; #pear = Pear;"),
+                {"#lrr": "loadingreadyrun", "#pear": "pear"})
+
+    def test_invalid_broadcasters(self):
+        for broadcaster_list in ("#lrr", "#lrr=", "=lrr", "#a=a;#b"):
+            with self.assertRaisesRegex(ValueError, "#channel=login"):
+                self.get_broadcasters(broadcaster_list)
+
+
+if __name__ == "__main__":
+    unittest.main()
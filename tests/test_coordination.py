@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_coordination.py
+
+Test coordinating instances through Postgres.
+Tests using the database run against DATABASE_DSN and are skipped unless it
+is set, e.g. to "host=localhost dbname=pump19_test".
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import coordination
+import dbutils
+import os
+import time
+import unittest
+import uuid
+
+from unittest import mock
+
+
+class CoordinationTestCase(unittest.TestCase):
+    """Run coordinators on a fresh event loop with a fresh pool."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        dbutils.get_pool._pool = None
+        dbutils.get_pool._lock = None
+
+        self.coordinators = list()
+        self.calls = list()
+        # keys are unique so tests don't see each other's rows
+        self.key = uuid.uuid4().hex
+
+    def tearDown(self):
+        for coordinator in self.coordinators:
+            coordinator.stop()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+        pool = dbutils.get_pool._pool
+        if pool:
+            pool.close()
+            self.loop.run_until_complete(pool.wait_closed())
+        dbutils.get_pool._pool = None
+        dbutils.get_pool._lock = None
+
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def coordinator(self, **kwargs):
+        coordinator = coordination.Coordinator(loop=self.loop, **kwargs)
+        self.coordinators.append(coordinator)
+        return coordinator
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    async def upstream(self, value):
+        self.calls.append(value)
+        await asyncio.sleep(0.1)
+        return {"value": value}
+
+
+class FallbackTest(CoordinationTestCase):
+    """Decide locally whenever the database fails."""
+
+    def test_stalled_pool(self):
+        async def stalled(loop=None):
+            await asyncio.sleep(3600)
+
+        coordinator = self.coordinator(timeout=0.05)
+        with mock.patch("dbutils.get_pool", side_effect=stalled) as get_pool:
+            with self.assertLogs("coordination", "ERROR"):
+                start = time.monotonic()
+                self.assertTrue(self.run_coro(coordinator.claim("cmd", 15)))
+                (_, value) = self.run_coro(
+                        coordinator.fetch(self.key, 60, self.upstream, 1))
+                self.assertLess(time.monotonic() - start, 1.0)
+
+            # a failed setup isn't retried for every call
+            self.assertTrue(self.run_coro(coordinator.claim("cmd", 15)))
+            self.assertEqual(get_pool.call_count, 1)
+
+        self.assertEqual(value, {"value": 1})
+        self.assertEqual(self.calls, [1])
+
+    def test_failing_pool(self):
+        coordinator = self.coordinator(retry=0.0)
+        error = ConnectionError("no database")
+        with mock.patch("dbutils.get_pool", side_effect=error) as get_pool:
+            with self.assertLogs("coordination", "ERROR"):
+                self.assertTrue(self.run_coro(coordinator.claim("cmd", 15)))
+                self.assertTrue(self.run_coro(coordinator.claim("cmd", 15)))
+
+        self.assertEqual(get_pool.call_count, 2)
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_DSN"),
+                     "DATABASE_DSN is not set")
+class DatabaseTest(CoordinationTestCase):
+    """Coordinate two instances through a real database."""
+
+    def test_claim(self):
+        first = self.coordinator()
+        second = self.coordinator()
+
+        self.assertTrue(self.run_coro(first.claim(self.key, 15)))
+        self.assertFalse(self.run_coro(second.claim(self.key, 15)))
+        self.assertFalse(self.run_coro(first.claim(self.key, 15)))
+
+        # windows are separate per name and end after their span
+        self.assertTrue(self.run_coro(second.claim(self.key + "/other", 15)))
+        self.run_coro(asyncio.sleep(0.1))
+        self.assertTrue(self.run_coro(second.claim(self.key, 0.05)))
+
+    def test_single_flight(self):
+        first = self.coordinator()
+        second = self.coordinator()
+        self.run_coro(asyncio.gather(first.prepare(), second.prepare()))
+
+        start = time.monotonic()
+        results = self.run_coro(asyncio.gather(
+            first.fetch(self.key, 60, self.upstream, 1),
+            second.fetch(self.key, 60, self.upstream, 2)))
+
+        # the waiting instance is notified long before it gives up
+        self.assertLess(time.monotonic() - start, first.wait)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results[0], results[1])
+
+        # the stored result is served as long as it's fresh
+        self.run_coro(second.fetch(self.key, 60, self.upstream, 3))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_expired_lease(self):
+        coordinator = self.coordinator()
+        self.run_coro(coordinator.prepare())
+
+        # an instance that died while querying upstream leaves its lease
+        self.run_coro(coordinator.query(coordination.LEASE_SQL, {
+            "key": self.key, "owner": "dead", "lease": 0.05}))
+        self.run_coro(asyncio.sleep(0.1))
+
+        start = time.monotonic()
+        (_, value) = self.run_coro(
+                coordinator.fetch(self.key, 60, self.upstream, 1))
+
+        self.assertLess(time.monotonic() - start, coordinator.wait)
+        self.assertEqual(value, {"value": 1})
+        self.assertEqual(self.calls, [1])
+
+    def test_held_lease(self):
+        coordinator = self.coordinator(wait=0.1)
+        self.run_coro(coordinator.prepare())
+
+        self.run_coro(coordinator.query(coordination.LEASE_SQL, {
+            "key": self.key, "owner": "busy", "lease": 60}))
+
+        # we give up waiting for the lease holder and query on our own
+        with self.assertLogs("coordination", "WARNING"):
+            (_, value) = self.run_coro(
+                    coordinator.fetch(self.key, 60, self.upstream, 1))
+
+        self.assertEqual(value, {"value": 1})
+        self.assertEqual(self.calls, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_diagnostics.py
+
+Test dumping the await chains of pending tasks.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import diagnostics
+import os
+import tempfile
+import unittest
+
+
+async def outer(future):
+    return await middle(future)
+
+
+async def middle(future):
+    return await inner(future)
+
+
+async def inner(future):
+    return await future
+
+
+class DumpTasksTest(unittest.TestCase):
+    """Dump a task suspended in a known await chain."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.future = self.loop.create_future()
+        self.task = self.loop.create_task(outer(self.future))
+        # run the task until it waits for the future
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def tearDown(self):
+        self.future.set_result(None)
+        self.loop.run_until_complete(self.task)
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_await_chain(self):
+        frames = diagnostics.get_await_chain(self.task)
+
+        self.assertEqual([frame.f_code.co_name for frame in frames],
+                         ["outer", "middle", "inner"])
+
+    def test_dump_tasks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertLogs("diagnostics", "INFO"):
+                diagnostics.dump_tasks(directory, self.loop)
+            (name,) = os.listdir(directory)
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                dump = f.read().splitlines()
+
+        self.assertEqual(dump[0], "1 pending task(s)")
+        frames = [line.split(", in ")[1] for line in dump
+                  if line.startswith("  File ")]
+        self.assertEqual(frames, ["outer", "middle", "inner"])
+        sources = [line.strip() for line in dump
+                   if line.startswith("    ")]
+        self.assertEqual(sources, ["return await middle(future)",
+                                   "return await inner(future)",
+                                   "return await future"])
+
+
+if __name__ == "__main__":
+    unittest.main()
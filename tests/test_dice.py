@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_dice.py
+
+Test the dice engine with seeded random number generators.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import dice
+import random
+import unittest
+
+SEEDS = range(50)
+
+
+class SelectionTest(unittest.TestCase):
+    """Translate roll selectors into kept dice."""
+
+    def test_no_selector(self):
+        self.assertEqual(dice.selection(4, None, 0), (4, False))
+
+    def test_keep(self):
+        self.assertEqual(dice.selection(4, "k", 3), (3, False))
+        self.assertEqual(dice.selection(4, "kh", 3), (3, False))
+        self.assertEqual(dice.selection(4, "kl", 3), (3, True))
+
+    def test_drop(self):
+        self.assertEqual(dice.selection(4, "d", 1), (3, False))
+        self.assertEqual(dice.selection(4, "dl", 1), (3, False))
+        self.assertEqual(dice.selection(4, "dh", 1), (3, True))
+
+    def test_amount_exceeds_count(self):
+        self.assertEqual(dice.selection(4, "kh", 10), (4, False))
+        self.assertEqual(dice.selection(4, "dl", 10), (0, False))
+
+    def test_no_such_selector(self):
+        with self.assertRaises(ValueError):
+            dice.selection(4, "x", 1)
+
+
+class RollTest(unittest.TestCase):
+    """Roll dice and check the results stay within their bounds."""
+
+    def assertBounds(self, count, sides, *, keep=None, lowest=False,
+                     modifier=0):
+        kept = count if keep is None else keep
+        for seed in SEEDS:
+            result = dice.roll(count, sides, keep=keep, lowest=lowest,
+                               modifier=modifier, rng=random.Random(seed))
+            self.assertGreaterEqual(result.total, kept + modifier)
+            self.assertLessEqual(result.total, kept * sides + modifier)
+
+    def test_bounds(self):
+        for count in (1, 3, dice.SAMPLE_LIMIT, dice.SAMPLE_LIMIT + 1, 10000):
+            for sides in (1, 2, 6, 20, 10 ** 6):
+                self.assertBounds(count, sides)
+                self.assertBounds(count, sides, keep=count // 2)
+                self.assertBounds(count, sides, keep=count // 2, lowest=True)
+                self.assertBounds(count, sides, modifier=-7)
+
+    def test_huge_bounds(self):
+        self.assertBounds(10 ** 100, 10 ** 100, keep=10 ** 99,
+                          modifier=10 ** 100)
+
+    def test_invalid_rolls(self):
+        for (count, sides, modifier) in ((0, 6, 0), (1, 0, 0),
+                                         (10 ** 100 + 1, 6, 0),
+                                         (1, 10 ** 100 + 1, 0),
+                                         (1, 6, 10 ** 100 + 1),
+                                         (1, 6, -10 ** 100 - 1)):
+            with self.assertRaises(ValueError):
+                dice.roll(count, sides, modifier=modifier)
+
+    def test_seeded(self):
+        first = dice.roll(4, 6, keep=3, rng=random.Random(19))
+        second = dice.roll(4, 6, keep=3, rng=random.Random(19))
+        self.assertEqual(first, second)
+
+    def test_dropped_dice(self):
+        for seed in SEEDS:
+            for lowest in (False, True):
+                result = dice.roll(4, 6, keep=3, lowest=lowest, modifier=2,
+                                   rng=random.Random(seed))
+                (dropped,) = result.dropped
+                kept = [die for (index, die) in enumerate(result.dice)
+                        if index != dropped]
+                self.assertEqual(result.total, sum(kept) + 2)
+                if lowest:
+                    self.assertEqual(result.dice[dropped], max(result.dice))
+                else:
+                    self.assertEqual(result.dice[dropped], min(result.dice))
+
+    def test_sample_limit(self):
+        rng = random.Random(19)
+
+        result = dice.roll(dice.SAMPLE_LIMIT, 6, rng=rng)
+        self.assertEqual(len(result.dice), dice.SAMPLE_LIMIT)
+        self.assertEqual(result.total, sum(result.dice))
+
+        result = dice.roll(dice.SAMPLE_LIMIT + 1, 6, rng=rng)
+        self.assertIsNone(result.dice)
+        self.assertIsNone(result.dropped)
+
+    def test_single_side(self):
+        result = dice.roll(10 ** 6, 1, keep=10, modifier=1)
+        self.assertEqual(result, dice.Roll(11, None, None))
+
+    def test_approximated_sum(self):
+        # 10^6 d6 has a mean of 3.5 * 10^6 and a deviation below 2000
+        for seed in SEEDS:
+            result = dice.roll(10 ** 6, 6, rng=random.Random(seed))
+            self.assertAlmostEqual(result.total, 3500000, delta=10000)
+
+    def test_approximated_selection(self):
+        # the highest (lowest) of many dice are almost always 6 (1)
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            self.assertEqual(dice.roll(10 ** 6, 6, keep=3, rng=rng).total, 18)
+            self.assertEqual(dice.roll(10 ** 6, 6, keep=3, lowest=True,
+                                       rng=rng).total, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
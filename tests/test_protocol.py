@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_protocol.py
+
+Test the IRC client without connecting to a network.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import protocol
+import unittest
+
+from unittest import mock
+
+
+class UpdateChannelsTest(unittest.TestCase):
+    """Join and part channels when the configured ones change."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.client = protocol.Protocol(channels=["#a", "#b"])
+        self.client.irc.send = mock.Mock()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_join_and_part(self):
+        self.client.update_channels(["#b", "#c", "#d"])
+
+        self.assertEqual(self.client.irc.send.mock_calls, [
+            mock.call("PART", channel="#a"),
+            mock.call("JOIN", channel="#c"),
+            mock.call("JOIN", channel="#d")])
+        self.assertEqual(self.client.channels, ["#b", "#c", "#d"])
+
+    def test_unchanged(self):
+        self.client.update_channels(["#b", "#a"])
+
+        self.client.irc.send.assert_not_called()
+        self.assertEqual(self.client.channels, ["#b", "#a"])
+
+    def test_copied(self):
+        channels = ["#a"]
+        self.client.update_channels(channels)
+        channels.append("#b")
+
+        self.assertEqual(self.client.channels, ["#a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
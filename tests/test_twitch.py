@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf-8:ts=8:et:sw=4:sts=4:tw=79
+
+"""
+test_twitch.py
+
+Test the Twitch API utilities against a local stub of the API.
+
+Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
+See the file LICENSE for copying permission.
+"""
+
+import asyncio
+import math
+import os
+import twitch
+import unittest
+
+from aiohttp import web
+from unittest import mock
+
+USERS = {"user{0}".format(n): str(1000 + n) for n in range(250)}
+
+
+class StubAPI:
+    """A stub of the Twitch API endpoints we use, counting requests."""
+
+    def __init__(self):
+        self.requests = list()
+        self.app = web.Application()
+        self.app.router.add_get("/users", self.users)
+        self.app.router.add_get("/channels/{channel}/videos", self.videos)
+        self.app.router.add_get("/clips/top", self.clips)
+
+    async def users(self, request):
+        logins = request.query["login"].split(",")
+        self.requests.append(("users", logins))
+        return web.json_response({"users": [
+            {"_id": USERS[login], "name": login}
+            for login in logins if login in USERS]})
+
+    async def videos(self, request):
+        channel = request.match_info["channel"]
+        self.requests.append(("videos", channel))
+        return web.json_response({"videos": [
+            {"title": "Broadcast", "url": "https://example.org/" + channel,
+             "recorded_at": "2018-01-01T00:00:00Z"}]})
+
+    async def clips(self, request):
+        channel = request.query["channel"]
+        self.requests.append(("clips", channel))
+        return web.json_response({"clips": [
+            {"title": "Clip", "slug": channel + "Slug",
+             "created_at": "2018-01-01T00:00:00Z"}]})
+
+
+class TwitchTest(unittest.TestCase):
+    """Run the Twitch API utilities against a local stub of the API."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.api = StubAPI()
+        self.runner = web.AppRunner(self.api.app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+
+        patcher = mock.patch.dict(os.environ, {
+            "TWITCH_CLIENT_ID": "stub",
+            "TWITCH_API_URL": "http://127.0.0.1:{0}".format(port)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def user_requests(self):
+        return [logins for (kind, logins) in self.api.requests
+                if kind == "users"]
+
+    def test_batched_logins(self):
+        client = twitch.Client(loop=self.loop)
+        logins = sorted(USERS)
+
+        ids = self.run_coro(asyncio.gather(
+            *(client.get_id(login) for login in logins)))
+
+        self.assertEqual(ids, [USERS[login] for login in logins])
+        requests = self.user_requests()
+        self.assertEqual(len(requests), math.ceil(len(logins) / 100))
+        self.assertEqual(sorted(sum(requests, [])), logins)
+
+    def test_cached_ids(self):
+        client = twitch.Client(loop=self.loop)
+
+        self.run_coro(client.get_ids(["User1", "user2"]))
+        ids = self.run_coro(client.get_ids(["user1", "USER2"]))
+
+        self.assertEqual(ids, {"user1": USERS["user1"],
+                               "user2": USERS["user2"]})
+        self.assertEqual(len(self.user_requests()), 1)
+
+    def test_unknown_login(self):
+        client = twitch.Client(loop=self.loop)
+
+        ids = self.run_coro(client.get_ids(["user1", "nobody"]))
+        self.assertEqual(ids, {"user1": USERS["user1"], "nobody": None})
+
+        # unknown logins are remembered as well
+        self.assertIsNone(self.run_coro(client.get_id("nobody")))
+        self.assertEqual(len(self.user_requests()), 1)
+
+    def test_cancelled_caller(self):
+        client = twitch.Client(loop=self.loop)
+
+        async def race():
+            first = self.loop.create_task(client.get_id("user1"))
+            second = self.loop.create_task(client.get_id("user1"))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(self.run_coro(race()), USERS["user1"])
+
+    def test_broadcasts_and_clips(self):
+        broadcasts = self.run_coro(twitch.get_broadcasts("1001", 1))
+        clips = self.run_coro(twitch.get_top_clips("user1", 1))
+
+        self.assertEqual(broadcasts, [("Broadcast", "https://example.org/1001",
+                                       "2018-01-01T00:00:00Z")])
+        self.assertEqual(clips, [("Clip", "user1Slug",
+                                  "2018-01-01T00:00:00Z")])
+
+
+if __name__ == "__main__":
+    unittest.main()
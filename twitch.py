@@ -6,40 +6,53 @@ twitch.py
 
 File containing Twitch API utility functions.
 It sets up logging and provides coroutines for querying Twitch.tv APIs.
+The API location can be changed through TWITCH_API_URL (e.g. to run against
+a local stub). Both that and TWITCH_CLIENT_ID are read on every request, so
+they can be changed by reloading the configuration.
 
 Copyright (c) 2018 Twisted Pear <tp at pump19 dot eu>
 See the file LICENSE for copying permission.
 """
 
 import aiohttp
+import asyncio
 import logging
-import os
 
-CLIENT_ID = os.environ["TWITCH_CLIENT_ID"]
-VIDEOS_URL = ("https://api.twitch.tv/kraken/channels/"
-              "{channel}/videos?limit={limit}&broadcast_type=archive")
-CLIPS_URL = ("https://api.twitch.tv/kraken/clips/top"
-             "?channel={channel}&limit={limit}")
+from os import environ
 
-TWITCH_API_HEADERS = {
-    "Accept": "application/vnd.twitchtv.v5+json",
-    "Client-ID": CLIENT_ID
-}
+API_URL = "https://api.twitch.tv/kraken"
+VIDEOS_PATH = "/channels/{channel}/videos?limit={limit}&broadcast_type=archive"
+CLIPS_PATH = "/clips/top?channel={channel}&limit={limit}"
+USERS_PATH = "/users?login={logins}"
+# the users endpoint accepts up to 100 logins per request
+USERS_LIMIT = 100
+
+
+def get_api_url(path, **kwargs):
+    """Get the URL of an API endpoint with its parameters filled in."""
+    api_url = environ.get("TWITCH_API_URL", API_URL)
+    return api_url + path.format(**kwargs)
+
+
+def get_api_headers():
+    """Get the headers sent along with every API request."""
+    return {"Accept": "application/vnd.twitchtv.v5+json",
+            "Client-ID": environ["TWITCH_CLIENT_ID"]}
 
 
 async def get_broadcasts(channel, limit, loop=None):
     """
     Request the latest n broadcasts for a given channel.
-    Returns an iterable of broadcasts, each entry being a tuple of title, url
-    and date.
+    Returns a list of broadcasts, each entry being a tuple of title, url and
+    date.
     """
     logger = logging.getLogger("twitch")
     logger.info("Requesting {limit} broadcast(s) for {channel}.".format(
         channel=channel, limit=limit))
 
-    bc_url = VIDEOS_URL.format(channel=channel, limit=limit)
-    with aiohttp.ClientSession(
-            read_timeout=30, headers=TWITCH_API_HEADERS,
+    bc_url = get_api_url(VIDEOS_PATH, channel=channel, limit=limit)
+    async with aiohttp.ClientSession(
+            read_timeout=30, headers=get_api_headers(),
             loop=loop) as client:
 
         bc_req = await client.get(bc_url)
@@ -48,21 +61,22 @@ async def get_broadcasts(channel, limit, loop=None):
     logger.debug("Retrieved {nof} broadcasts for {channel}.".format(
         nof=len(broadcasts["videos"]), channel=channel))
 
-    return ((video["title"], video["url"], video["recorded_at"])
-            for video in broadcasts["videos"])
+    return [(video["title"], video["url"], video["recorded_at"])
+            for video in broadcasts["videos"]]
 
 
 async def get_top_clips(channel, limit, loop=None):
     """
     Request the top n clips for a given channel.
+    Returns a list of clips, each entry being a tuple of title, slug and date.
     """
     logger = logging.getLogger("twitch")
     logger.info("Requesting {limit} clip(s) for {channel}.".format(
         channel=channel, limit=limit))
 
-    tc_url = CLIPS_URL.format(channel=channel, limit=limit)
-    with aiohttp.ClientSession(
-            read_timeout=30, headers=TWITCH_API_HEADERS,
+    tc_url = get_api_url(CLIPS_PATH, channel=channel, limit=limit)
+    async with aiohttp.ClientSession(
+            read_timeout=30, headers=get_api_headers(),
             loop=loop) as client:
 
         tc_req = await client.get(tc_url)
@@ -71,5 +85,125 @@ async def get_top_clips(channel, limit, loop=None):
     logger.debug("Retrieved {nof} clips for {channel}.".format(
         nof=len(clips["clips"]), channel=channel))
 
-    return ((clip["title"], clip["slug"], clip["created_at"])
-            for clip in clips["clips"])
+    return [(clip["title"], clip["slug"], clip["created_at"])
+            for clip in clips["clips"]]
+
+
+async def get_users(logins, loop=None):
+    """
+    Request user information for up to 100 logins at once.
+    Returns a dictionary mapping logins to channel IDs, logins that don't
+    exist are missing.
+    """
+    logger = logging.getLogger("twitch")
+    logger.info("Requesting channel IDs for {logins}.".format(
+        logins=",".join(logins)))
+
+    us_url = get_api_url(USERS_PATH, logins=",".join(logins))
+    async with aiohttp.ClientSession(
+            read_timeout=30, headers=get_api_headers(),
+            loop=loop) as client:
+
+        us_req = await client.get(us_url)
+        users = await us_req.json(encoding="utf-8")
+
+    logger.debug("Retrieved {nof} users.".format(nof=len(users["users"])))
+
+    return {user["name"]: user["_id"] for user in users["users"]}
+
+
+class Client:
+    """
+    A Twitch client resolving logins to channel IDs.
+    Resolved IDs are cached forever (they never change), logins that don't
+    exist are remembered for retry seconds. Logins requested within a short
+    delay of each other are resolved with as few API requests as possible.
+    """
+    logger = logging.getLogger("twitch")
+
+    def __init__(self, *, loop=None, delay=0.05, retry=3600.0):
+        """Initialize the client with an empty ID cache."""
+        self.loop = loop or asyncio.get_event_loop()
+        self.delay = delay
+        self.retry = retry
+        self.ids = dict()
+        # logins that don't exist, mapped to when we found out
+        self.missing = dict()
+        # logins waiting to be requested and logins waiting for a response
+        self.queued = list()
+        self.futures = dict()
+        self.flusher = None
+
+    async def get_id(self, login):
+        """Get the channel ID for a login or None if there is no such user."""
+        ids = await self.get_ids([login])
+        return ids[login.lower()]
+
+    async def get_ids(self, logins):
+        """
+        Get the channel IDs for several logins.
+        Returns a dictionary mapping (lowercase) logins to channel IDs or None
+        if there is no such user.
+        """
+        logins = set(login.lower() for login in logins)
+
+        now = self.loop.time()
+        unknown = [login for login in logins - self.ids.keys()
+                   if now - self.missing.get(login, -self.retry) >= self.retry]
+
+        waiting = list()
+        for login in unknown:
+            future = self.futures.get(login)
+            if not future:
+                future = self.loop.create_future()
+                self.futures[login] = future
+                self.queued.append(login)
+            waiting.append(future)
+
+        if len(self.queued) >= USERS_LIMIT:
+            self.flush()
+        elif self.queued and not self.flusher:
+            self.flusher = self.loop.call_later(self.delay, self.flush)
+
+        # other callers wait for the same futures, don't cancel them
+        if waiting:
+            await asyncio.gather(*(asyncio.shield(future)
+                                   for future in waiting))
+
+        return {login: self.ids.get(login) for login in logins}
+
+    def flush(self):
+        """Request IDs for all queued logins in batches."""
+        if self.flusher:
+            self.flusher.cancel()
+            self.flusher = None
+
+        queued = self.queued
+        self.queued = list()
+
+        for start in range(0, len(queued), USERS_LIMIT):
+            batch = queued[start:start + USERS_LIMIT]
+            self.loop.create_task(self.resolve(batch))
+
+    async def resolve(self, batch):
+        """Resolve a batch of logins and wake up everyone waiting for it."""
+        error = None
+        try:
+            ids = await get_users(batch, loop=self.loop)
+        except Exception as e:
+            self.logger.error("Cannot resolve channel IDs: {0!r}".format(e))
+            error = e
+        else:
+            self.ids.update(ids)
+            now = self.loop.time()
+            self.missing.update((login, now) for login in batch
+                                if login not in ids)
+
+        for login in batch:
+            future = self.futures.pop(login)
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(ids.get(login))